@@ -12,11 +12,13 @@ DESCRIPTION = 'Easy clean latex compiler using latexmk under the hood'
 URL = 'https://gitlab.psb.ugent.be/blah-blah'
 EMAIL = 'sam.demeyer@psb.ugent.be'
 AUTHOR = 'Sam De Meyer <samey>'
-REQUIRES_PYTHON = '>=3.7.0'
+REQUIRES_PYTHON = '>=3.8.0'
 VERSION = '0.1.0'
 
 # What packages are required for this module to be executed?
-REQUIRED = []
+REQUIRED = [
+    'watchfiles>=0.21',
+]
 
 # What packages are optional?
 EXTRAS = {
@@ -56,7 +58,7 @@ setup(
         # Trove classifiers
         # Full list: https://pypi.python.org/pypi?%3Aaction=list_classifiers
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: Implementation :: CPython',
     ],
 )
@@ -1,40 +1,100 @@
 #!/usr/bin/env python3
 
-import shutil
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import stat
+import sys
 from argparse import Namespace
 from os import path
-from shutil import copy2
-from subprocess import run, CalledProcessError
-from typing import List
+from shutil import copyfile
+from subprocess import CalledProcessError
+from typing import List, Optional
 
-from texbuild.arbitrary import default, makedir, having_cwd
+import watchfiles
+
+from texbuild.arbitrary import copy_file_fast, parallel_rmtree
 
 
 # ---------------------------------------------------------------------------------------------------------------------
 
 
 class Bcolors:
-    HEADER    = '\033[95m'
-    INFOBLUE  = '\033[94m'
-    OKGREEN   = '\033[92m'
-    WARNING   = '\033[93m'
-    FAIL      = '\033[91m'
-    ENDC      = '\033[0m'
-    BOLD      = '\033[1m'
-    UNDERLINE = '\033[4m'
+    # pre-encoded, so they can be written to the binary stdout buffer as is
+    HEADER    = b'\033[95m'
+    INFOBLUE  = b'\033[94m'
+    OKGREEN   = b'\033[92m'
+    WARNING   = b'\033[93m'
+    FAIL      = b'\033[91m'
+    ENDC      = b'\033[0m'
+    BOLD      = b'\033[1m'
+    UNDERLINE = b'\033[4m'
+
+
+_BOLD = Bcolors.BOLD
+_ENDC = Bcolors.ENDC
 
 
-def print_markup(txt, markup=Bcolors.INFOBLUE, *args, **kwargs):
-    print(markup + txt + Bcolors.ENDC, *args, **kwargs)
+def _write_stdout(buf: bytes):
+    buffer = getattr(sys.stdout, "buffer", None)
+    if buffer is None:  # a text-only stream, e.g. io.StringIO or a notebook output stream
+        sys.stdout.write(buf.decode("utf-8", errors="replace"))
+        sys.stdout.flush()
+        return
+    sys.stdout.flush()  # keeps the order with text that was written with `print`
+    buffer.write(buf)
+    buffer.flush()
+
+
+def print_markup(txt, markup=Bcolors.INFOBLUE, end="\n"):
+    _write_stdout(markup + txt.encode("utf-8") + _ENDC + end.encode("utf-8"))
 
 
 def print_frame(txt, markup=Bcolors.INFOBLUE + Bcolors.BOLD):
-    border = "*" * (max(map(len, txt.splitlines())) + 4)
-    print_markup(border, Bcolors.BOLD)
-    print_markup("| ", Bcolors.BOLD, end='')
-    print_markup(txt, markup, end='')
-    print_markup(" |", Bcolors.BOLD)
-    print_markup(border, Bcolors.BOLD)
+    # the whole frame is rendered up front and written at once
+    border = _BOLD + b"*" * (max(map(len, txt.splitlines())) + 4) + _ENDC + b"\n"
+    _write_stdout(border +
+                  _BOLD + b"| " + _ENDC + markup + txt.encode("utf-8") + _ENDC + _BOLD + b" |" + _ENDC + b"\n" +
+                  border)
+
+
+async def run_async(command: List[str], cwd: str = None):
+    """
+    Runs a command without blocking the event loop, its output is streamed to stdout as it arrives.
+
+    :raises CalledProcessError: If the command exits with a non-zero return code.
+    """
+    proc = await asyncio.create_subprocess_exec(*command, cwd=cwd,
+                                                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    try:
+        # fixed size chunks instead of lines: no limit on line length, and partial lines show up immediately
+        while chunk := await proc.stdout.read(65536):
+            _write_stdout(chunk)
+        return_code = await proc.wait()
+    except BaseException:
+        # e.g. cancelled, or stdout could not be written: don't leave the process running unattended
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if return_code != 0:
+        raise CalledProcessError(return_code, command)
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+class SourceFilter(watchfiles.DefaultFilter):
+    """
+    Ignores latex intermediates and editor temp files,
+    so the build loop is only woken up by meaningful edits.
+    """
+
+    ignored_suffixes = (".aux", ".log", ".swp", ".swx", ".tmp", "~")
+
+    def __call__(self, change: watchfiles.Change, pafh: str) -> bool:
+        return not pafh.endswith(self.ignored_suffixes) and super().__call__(change, pafh)
 
 # ---------------------------------------------------------------------------------------------------------------------
 
@@ -43,7 +103,7 @@ class TexBuild:
     """
     Clean build system to make Tex files with latexmk
 
-    Under the hood it rsyncs all source files to a build directory,
+    Under the hood it syncs all source files to a build directory,
     then the build is done with `latexmk` in that directory and the output is copied to a destination directory (dst).
     This has three advantages:
         - It prevents intermediary files from polluting the source code folders
@@ -56,57 +116,189 @@ class TexBuild:
 
         /tex_root/
             ┣ src/  (source code is here)
-            ┣ bld/  (`src` is rsynced to here, then pdf is built here)
+            ┣ bld/  (`src` is synced to here, then pdf is built here)
             ┗ dst/  (output pdf file is copied to here)
     """
 
-    def __init__(self, tex_root: str):
+    # latex intermediates are regenerated in bld anyway, copying them from src is wasted work
+    excluded_suffixes = (".aux", ".log", ".fls", ".fdb_latexmk")
+    # records the (size, mtime) of every synced source file and the listing of every source directory, lives in bld
+    manifest_filename = ".texbuild-manifest.json"
+    # per document: the latexmk options and the signatures of the synced files its last successful build read
+    deps_filename = ".texbuild-deps.json"
+    # a burst of changes (e.g. an editor's "write temp file, then rename" save) is coalesced into a single rebuild:
+    # the burst ends after `watch_step_ms` without new changes, but lasts at most `watch_debounce_ms`
+    watch_debounce_ms = 500
+    watch_step_ms = 50
+
+    def __init__(self, tex_root: str, link_sources=False):
         """
         :param tex_root: The parent folder containing the source directory.
             This folder contains the source (src), build (bld) and destination (dst) directories.
+        :param link_sources: Hardlink source files into the build directory instead of copying them,
+            if both live on the same file system. Only use this if your editor replaces files when saving,
+            an editor writing in place would also write through the link into the build directory.
         """
         self._tex_root = tex_root
+        self.link_sources = link_sources
+        self.tex_src = path.join(tex_root, "src")
+        self.tex_bld = path.join(tex_root, "bld")
+        self.tex_dst = path.join(tex_root, "dst")
     
     @property
     def tex_root(self):
         return self._tex_root
     
-    @property
-    def tex_src(self):
-        return path.join(self.tex_root, "src")
-
-    @property
-    def tex_bld(self):
-        return path.join(self.tex_root, "bld")
-
-    @property
-    def tex_dst(self):
-        return path.join(self.tex_root, "dst")
-    
     def init_dirs(self):
-        makedir(self.tex_root, recursive=True, exists_ok=True)
-        makedir(self.tex_src, exists_ok=True)
+        os.makedirs(self.tex_src, exist_ok=True)
 
     def copy_build_files(self):
         """
         Synchronizes files in the source directory to the build directory.
+        Only files whose size or modification time changed since the previous sync are copied,
+        latex intermediates (see `excluded_suffixes`) are skipped.
         Files existing only in the build directory are not modified.
-        """
-        rsync_command = ["rsync", "-av", self.tex_src + "/", self.tex_bld]
 
+        :return: The signature (size, mtime) of every synced file, by path relative to the source directory.
+        """
         print_frame("COPYING BUILD FILES TO BLD DIRECTORY")
-        makedir(self.tex_bld, exists_ok=True)
-        run(rsync_command)
+        os.makedirs(self.tex_bld, exist_ok=True)
+
+        manifest_path = path.join(self.tex_bld, self.manifest_filename)
+        try:
+            with open(manifest_path) as f:
+                old_manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            old_manifest = {}
+
+        link = self.link_sources and os.stat(self.tex_src).st_dev == os.stat(self.tex_bld).st_dev
+
+        new_manifest = {"files": {}, "dirs": {}}
+        self._sync_dir("", old_manifest.get("files", {}), old_manifest.get("dirs", {}),
+                       new_manifest["files"], new_manifest["dirs"], link)
+
+        with open(manifest_path, "w") as f:
+            json.dump(new_manifest, f)
+        return new_manifest["files"]
+
+    def _sync_dir(self, rel_dir: str, old_files: dict, old_dirs: dict, new_files: dict, new_dirs: dict,
+                  link: bool):
+        """
+        Syncs one directory (relative to the source directory), then recurses into its sub-directories.
+
+        A directory's mtime only changes when entries are added, removed or renamed, not when a file is edited.
+        So if it is unchanged, the listing from the previous sync is reused instead of reading the directory again,
+        but every file is still checked against its own signature.
+        """
+        src_dir = path.join(self.tex_src, rel_dir)
+        bld_dir = path.join(self.tex_bld, rel_dir)
+
+        try:
+            dir_mtime = os.stat(src_dir).st_mtime_ns
+        except FileNotFoundError:
+            return  # removed since its parent was listed
+        cached = old_dirs.get(rel_dir)
+        if cached is not None and cached[0] == dir_mtime:
+            _, file_names, dir_names = cached
+        else:
+            file_names, dir_names = [], []
+            with os.scandir(src_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        os.makedirs(path.join(bld_dir, entry.name), exist_ok=True)
+                        dir_names.append(entry.name)
+                    elif not entry.name.endswith(self.excluded_suffixes):
+                        file_names.append(entry.name)
+        new_dirs[rel_dir] = [dir_mtime, file_names, dir_names]
+
+        for name in file_names:
+            rel_path = path.join(rel_dir, name)
+            src_path = path.join(src_dir, name)
+            try:
+                # symlinks (possibly dangling, e.g. emacs lock files) are synced as links, not followed
+                src_stat = os.lstat(src_path)
+                signature = [src_stat.st_size, src_stat.st_mtime_ns]
+                if old_files.get(rel_path) != signature:
+                    print(rel_path)
+                    self._sync_file(src_path, path.join(bld_dir, name), src_stat, link)
+            except FileNotFoundError:
+                continue  # removed while syncing (e.g. an editor replacing the file), the next sync picks it up
+            new_files[rel_path] = signature
+
+        for name in dir_names:
+            self._sync_dir(path.join(rel_dir, name), old_files, old_dirs, new_files, new_dirs, link)
+
+    @staticmethod
+    def _sync_file(src_path: str, bld_path: str, src_stat: os.stat_result, link: bool):
+        # never write into the existing file, it may be a hardlink to the source
+        try:
+            os.unlink(bld_path)
+        except FileNotFoundError:
+            pass
+
+        if stat.S_ISLNK(src_stat.st_mode):
+            os.symlink(os.readlink(src_path), bld_path)
+            return
+
+        if link:
+            try:
+                os.link(src_path, bld_path)
+                return
+            except OSError:
+                pass  # e.g. the file system does not support hardlinks, just copy instead
+
+        # only the mtime is carried over (no permissions/ownership)
+        copyfile(src_path, bld_path)
+        os.utime(bld_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
+    async def _run_latexmk_in_bld_dir(self, tex_filename: str, latexmk_opts: List, precompile_preamble=False):
+        """
+        :param precompile_preamble: Load the preamble from a precompiled format (see `_ensure_fmt_file`),
+            instead of parsing it (and loading all of its packages) on every run.
+        """
+        pdflatex = "lualatex"
+        if precompile_preamble:
+            fmt_name = await self._ensure_fmt_file(tex_filename)
+            pdflatex = "lualatex -fmt=" + fmt_name + " %O %S"
 
-    def _run_latexmk_in_bld_dir(self, tex_filename: str, latexmk_opts: List):
         build_command = ["latexmk",
                          "-halt-on-error", "-interaction=nonstopmode",
-                         "-pdflatex=lualatex", "-pdf", tex_filename + ".tex"] + \
+                         "-pdflatex=" + pdflatex, "-pdf", "-recorder", tex_filename + ".tex"] + \
                         latexmk_opts
 
-        with having_cwd(self.tex_bld):
-            print_frame("BUILDING DOCUMENT")
-            run(build_command, check=True)
+        print_frame("BUILDING DOCUMENT")
+        await run_async(build_command, cwd=self.tex_bld)
+
+    async def _ensure_fmt_file(self, tex_filename: str) -> str:
+        """
+        Dumps the preamble of a document (everything before `\\begin{document}`) to a format file in the build
+        directory, using the `mylatexformat` package. The format is only regenerated when the preamble text changes,
+        changes in files the preamble loads with `\\input` go unnoticed (remove the build directory in that case).
+
+        :return: The name of the format, to be passed to `lualatex -fmt=`.
+        """
+        fmt_name = path.basename(tex_filename) + "-preamble"
+        fmt_path = path.join(self.tex_bld, fmt_name + ".fmt")
+        stamp_path = fmt_path + ".sha1"
+
+        with open(path.join(self.tex_bld, tex_filename + ".tex"), "rb") as f:
+            preamble = f.read().split(b"\\begin{document}", 1)[0]
+        digest = hashlib.sha1(preamble).hexdigest()
+        try:
+            with open(stamp_path) as f:
+                if f.read() == digest and path.exists(fmt_path):
+                    return fmt_name
+        except FileNotFoundError:
+            pass
+
+        fmt_command = ["lualatex", "-ini", "-interaction=nonstopmode", "-jobname=" + fmt_name,
+                       "&lualatex", "mylatexformat.ltx", tex_filename + ".tex"]
+
+        print_frame("PRECOMPILING PREAMBLE")
+        await run_async(fmt_command, cwd=self.tex_bld)
+        with open(stamp_path, "w") as f:
+            f.write(digest)
+        return fmt_name
 
     def _copy_to_dst(self, tex_filename: str, pdf_filename: str):
         """
@@ -116,45 +308,205 @@ class TexBuild:
         document_pdf_bld = path.join(self.tex_bld, tex_filename + ".pdf")
         document_pdf_dst = path.join(self.tex_dst, pdf_filename + ".pdf")
 
-        makedir(self.tex_dst, exists_ok=True)
-        copy2(document_pdf_bld, document_pdf_dst)
+        os.makedirs(self.tex_dst, exist_ok=True)
+        copy_file_fast(document_pdf_bld, document_pdf_dst)
 
-    def build_document(self, tex_filename, pdf_filename=None, latexmk_opts=None):
+    def build_document(self, tex_filename, pdf_filename=None, latexmk_opts=None, precompile_preamble=False):
         """
         tex_filename and pdf_filename must be given WITHOUT the file extension
         """
+        return asyncio.run(self._abuild_document(tex_filename, pdf_filename, latexmk_opts, precompile_preamble))
+
+    async def _abuild_document(self, tex_filename, pdf_filename=None, latexmk_opts=None, precompile_preamble=False):
+        latexmk_opts = latexmk_opts if latexmk_opts is not None else []
+        pdf_filename = pdf_filename if pdf_filename is not None else tex_filename
+
+        manifest = self.copy_build_files()
+        return await self._abuild_synced_document(tex_filename, pdf_filename, latexmk_opts, precompile_preamble,
+                                                  manifest)
+
+    def build_documents(self, tex_filenames: List[str], latexmk_opts=None, max_parallel=None,
+                        precompile_preamble=False) -> List[bool]:
+        """
+        Builds several documents concurrently, each pdf gets the name of its tex file.
+        The source files are synced once, then one latexmk process is run per document.
+
+        tex_filenames must be given WITHOUT the file extension. Each document is built only once,
+        even if it is listed several times (latexmk names its intermediate files after the document,
+        so two concurrent builds of the same document would corrupt each other's files).
 
-        latexmk_opts = default(latexmk_opts, [])
-        pdf_filename = default(pdf_filename, tex_filename)
+        :param max_parallel: Maximum number of latexmk processes running at once, defaults to the number of cpus.
+        :return: For each given document, whether its build succeeded.
+        """
+        if max_parallel is not None and max_parallel < 1:
+            raise ValueError(f"max_parallel must be at least 1, got {max_parallel}")
+        return asyncio.run(self._abuild_documents(tex_filenames, latexmk_opts, max_parallel, precompile_preamble))
+
+    async def _abuild_documents(self, tex_filenames: List[str], latexmk_opts=None, max_parallel=None,
+                                precompile_preamble=False):
+        latexmk_opts = latexmk_opts if latexmk_opts is not None else []
+        slots = asyncio.Semaphore(max_parallel or os.cpu_count() or 1)
+
+        async def build_one(tex_filename):
+            async with slots:
+                return await self._abuild_synced_document(tex_filename, tex_filename, latexmk_opts,
+                                                          precompile_preamble, manifest)
+
+        manifest = self.copy_build_files()
+        unique_filenames = list(dict.fromkeys(tex_filenames))
+        successes = dict(zip(unique_filenames, await asyncio.gather(*map(build_one, unique_filenames))))
+        return [successes[tex_filename] for tex_filename in tex_filenames]
+
+    async def _abuild_synced_document(self, tex_filename: str, pdf_filename: str, latexmk_opts: List,
+                                      precompile_preamble: bool, manifest: dict):
+        """
+        Builds a document whose sources are already synced to the build directory.
+        latexmk is skipped entirely if none of the files read by the last successful build changed.
+
+        :param manifest: Signatures of the synced files, as returned by `copy_build_files`.
+        """
+        if self._is_up_to_date(tex_filename, latexmk_opts, precompile_preamble, manifest):
+            self._copy_to_dst(tex_filename, pdf_filename)
+            print_markup("BUILD SKIPPED (no dependencies changed)", Bcolors.OKGREEN, end="\n\n")
+            return True
 
+        # a failed build must not leave an outdated record behind
+        self._store_deps(tex_filename, None)
         try:
-            self.copy_build_files()
-            self._run_latexmk_in_bld_dir(tex_filename, latexmk_opts)
+            await self._run_latexmk_in_bld_dir(tex_filename, latexmk_opts, precompile_preamble)
+            self._store_deps(tex_filename,
+                             self._deps_record(tex_filename, latexmk_opts, precompile_preamble, manifest))
             self._copy_to_dst(tex_filename, pdf_filename)
             # Yeee!
             print_markup("BUILD SUCCESSFUL", Bcolors.OKGREEN, end="\n\n")
             success = True
-        except CalledProcessError:
+        except (CalledProcessError, OSError) as e:
             # Nooo...
+            if isinstance(e, OSError):  # e.g. the document (needed to precompile its preamble) does not exist
+                print(e)
             print_markup("BUILD FAILED", Bcolors.FAIL, end="\n\n")
             success = False
         return success
 
-    def wait_for_code_changes(self):
-        watch_command = ["inotifywait", "-e", "modify,create,delete,attrib", "-r", self.tex_src]
+    def _load_deps(self) -> dict:
+        try:
+            with open(path.join(self.tex_bld, self.deps_filename)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _store_deps(self, tex_filename: str, record: Optional[dict]):
+        # load, update and write without awaiting in between, so concurrent builds don't lose each other's records
+        all_deps = self._load_deps()
+        if record is None:
+            all_deps.pop(tex_filename, None)
+        else:
+            all_deps[tex_filename] = record
+        with open(path.join(self.tex_bld, self.deps_filename), "w") as f:
+            json.dump(all_deps, f)
 
+    def _deps_record(self, tex_filename: str, latexmk_opts: List, precompile_preamble: bool,
+                     manifest: dict) -> Optional[dict]:
+        """
+        Collects the synced files a finished build depended on, from the `.fls` file written by the tex engine
+        and the `.fdb_latexmk` file written by latexmk (which also lists e.g. the `.bib` files used by biber).
+        Returns None if neither file could be read, so the document will always be rebuilt.
+
+        Every file the build read gets a signature that follows symlinks, also files outside bld
+        (e.g. `\\input{/abs/macros.tex}` or a shared `.bib`), only the files the build itself generated in bld
+        are left out. Inputs the build looked for but did not find (e.g. an `\\include` of a file that does not
+        exist yet) are not recorded anywhere, that is why the record also lists all synced files:
+        any new one forces a rebuild.
+        """
+        read_files = set()
+        try:
+            with open(path.join(self.tex_bld, tex_filename + ".fls")) as f:
+                read_files |= {line[6:].strip() for line in f if line.startswith("INPUT ")}
+        except FileNotFoundError:
+            pass
+        try:
+            with open(path.join(self.tex_bld, tex_filename + ".fdb_latexmk")) as f:
+                read_files |= {line.split('"')[1] for line in f if line.startswith('  "')}
+        except FileNotFoundError:
+            pass
+        if not read_files:
+            return None
+
+        deps = {}
+        for read_file in read_files:
+            full_path = path.normpath(path.join(self.tex_bld, path.expanduser(read_file)))
+            rel_path = path.relpath(full_path, self.tex_bld)
+            if rel_path.startswith(".."):
+                deps[path.abspath(full_path)] = self._dep_signature(full_path)
+            elif rel_path in manifest:
+                deps[rel_path] = self._dep_signature(full_path)
+            # else: generated by the build itself
+        return {"latexmk_opts": latexmk_opts, "precompile_preamble": precompile_preamble, "deps": deps,
+                "sources": sorted(manifest)}
+
+    def _is_up_to_date(self, tex_filename: str, latexmk_opts: List, precompile_preamble: bool,
+                       manifest: dict) -> bool:
+        if "-g" in latexmk_opts or "-gg" in latexmk_opts:
+            return False  # the user explicitly asked for a rebuild
+        record = self._load_deps().get(tex_filename)
+        if record is None or record["latexmk_opts"] != latexmk_opts:
+            return False
+        if not set(manifest).issubset(record.get("sources", ())):
+            return False
+        if record.get("precompile_preamble", False) != precompile_preamble:
+            return False
+        if not path.exists(path.join(self.tex_bld, tex_filename + ".pdf")):
+            return False
+        # relative keys are synced sources in bld, absolute ones live outside of it (path.join keeps those as is)
+        return all(self._dep_signature(path.join(self.tex_bld, dep)) == signature
+                   for dep, signature in record["deps"].items())
+
+    @staticmethod
+    def _dep_signature(pafh: str) -> Optional[List[int]]:
+        # follows symlinks, so editing the target of a linked source counts as a change
+        try:
+            dep_stat = os.stat(pafh)
+        except OSError:
+            return None
+        return [dep_stat.st_size, dep_stat.st_mtime_ns]
+
+    def wait_for_code_changes(self):
+        """Blocks until a change is detected in the source directory."""
         print_frame("WATCHING SRC DIRECTORY FOR CHANGES")
-        run(watch_command)
+        next(watchfiles.watch(self.tex_src, watch_filter=SourceFilter(), recursive=True,
+                              debounce=self.watch_debounce_ms, step=self.watch_step_ms))
 
     def loop(self, *args, **kwargs):
+        """
+        Builds the document, then re-builds it on every change in the source directory.
+        Watching and building run concurrently, so changes made while a build is running
+        are not lost but trigger exactly one follow-up build.
+        """
+        try:
+            asyncio.run(self._aloop(*args, **kwargs))
+        except KeyboardInterrupt:
+            print()
+            print_markup("QUITTING (interrupt signal received)", Bcolors.WARNING)
+
+    async def _aloop(self, *args, **kwargs):
+        rebuild_requested = asyncio.Event()
+        rebuild_requested.set()  # always build once on startup
+        await asyncio.gather(
+            asyncio.create_task(self._file_watch_loop(rebuild_requested)),
+            asyncio.create_task(self._build_loop(rebuild_requested, *args, **kwargs)),
+        )
+
+    async def _file_watch_loop(self, rebuild_requested: asyncio.Event):
+        async for _ in watchfiles.awatch(self.tex_src, watch_filter=SourceFilter(),
+                                         debounce=self.watch_debounce_ms, step=self.watch_step_ms):
+            rebuild_requested.set()
+
+    async def _build_loop(self, rebuild_requested: asyncio.Event, *args, **kwargs):
         while True:
-            try:
-                self.build_document(*args, **kwargs)
-                self.wait_for_code_changes()
-            except KeyboardInterrupt:
-                print()
-                print_markup("QUITTING (interrupt signal received)", Bcolors.WARNING)
-                break
+            await rebuild_requested.wait()
+            rebuild_requested.clear()
+            await self._abuild_document(*args, **kwargs)
+            print_frame("WATCHING SRC DIRECTORY FOR CHANGES")
 
     def clean(self):
         """Removes the build directory"""
@@ -170,7 +522,7 @@ class TexBuild:
                 print(func)
                 print(exc_info[1])
 
-            shutil.rmtree(self.tex_bld, onerror=report_error)
+            parallel_rmtree(self.tex_bld, onerror=report_error)
         else:
             print(f"{self.tex_bld} already removed")
             
@@ -182,37 +534,65 @@ class TexBuild:
 # ---------------------------------------------------------------------------------------------------------------------
 
 
-def parse_cmd_args():
-    import argparse
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
 
+def _build_parser() -> argparse.ArgumentParser:
     # create the top-level parser
     parser = argparse.ArgumentParser(prog='texbuild', description='Build Tex pdf documents.')
     parser.add_argument('root', type=str, help="tex project root folder, contains `src`, `bld` and `dst` sub-folders")
+    parser.add_argument('--link-sources', action='store_true',
+                        help="hardlink source files into `bld` instead of copying them (when on the same file system), "
+                             "only safe if your editor replaces files when saving instead of writing in place")
     subparsers = parser.add_subparsers(dest="cmd", required=True, help="which of these actions to take")
     
-    # create helper parser
-    bld_parser = argparse.ArgumentParser(add_help=False)
+    # create helper parsers
+    opts_parser = argparse.ArgumentParser(add_help=False)
+    opts_parser.add_argument('--latexmk-opts', nargs='*', help="options passed to latexmk")
+    opts_parser.add_argument('--precompile-preamble', action='store_true',
+                             help="dump the document preamble to a format file once and reuse it "
+                                  "(requires the `mylatexformat` package)")
+    bld_parser = argparse.ArgumentParser(add_help=False, parents=[opts_parser])
     bld_parser.add_argument('document', type=str,
                             help="main document to build (relative to `src`, omit .tex extension)")
-    bld_parser.add_argument('--latexmk-opts', nargs='*', help="options passed to latexmk")
 
     # create the command specific parsers
     subparsers.add_parser('copy', help='copy all source files to the build directory')
     subparsers.add_parser('build', help='build the target document once', parents=[bld_parser])
     subparsers.add_parser('loop', help='re-build the target document on every source code change', parents=[bld_parser])
+    many_parser = subparsers.add_parser('build-many', help='build several documents once, in parallel',
+                                        parents=[opts_parser])
+    many_parser.add_argument('documents', type=str, nargs='+',
+                             help="documents to build (relative to `src`, omit .tex extension)")
+    many_parser.add_argument('-j', '--max-parallel', type=_positive_int,
+                             help="maximum number of documents built at once (default: number of cpus)")
     subparsers.add_parser('clean', help='remove the build directory')
 
-    return parser.parse_args()
+    return parser
+
+
+_PARSER = _build_parser()
+
+
+def parse_cmd_args():
+    return _PARSER.parse_args()
 
 
 def run_args(ns: Namespace):
-    tb = TexBuild(ns.root)
+    tb = TexBuild(ns.root, link_sources=ns.link_sources)
     if ns.cmd == "copy":
         tb.copy_build_files()
     if ns.cmd == "build":
-        tb.build_document(ns.document, ns.latexmk_opts)
+        tb.build_document(ns.document, latexmk_opts=ns.latexmk_opts, precompile_preamble=ns.precompile_preamble)
+    if ns.cmd == "build-many":
+        tb.build_documents(ns.documents, latexmk_opts=ns.latexmk_opts, max_parallel=ns.max_parallel,
+                           precompile_preamble=ns.precompile_preamble)
     if ns.cmd == "loop":
-        tb.loop(ns.document, ns.latexmk_opts)
+        tb.loop(ns.document, latexmk_opts=ns.latexmk_opts, precompile_preamble=ns.precompile_preamble)
     if ns.cmd == "clean":
         tb.clean()
 